@@ -1,38 +1,78 @@
 # app.py
-from datetime import datetime, timedelta
-from flask import Flask, render_template, redirect, url_for
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from operator import itemgetter
+from apscheduler.schedulers.background import BackgroundScheduler
+from flask import Flask, Response, render_template, redirect, request, url_for
+from flask_compress import Compress
+from jinja2 import FileSystemBytecodeCache
 from services.email_service import fetch_support_emails    # step 1: IMAP fetch function
-from services.nlp_service import analyze_email
+from services.nlp_service import analyze_emails_batch, content_hash
 from services.response_service import generate_response
-from utils.db import init_db, upsert_emails, fetch_emails
+from utils.db import init_db, upsert_emails, fetch_emails, fetch_message_ids, fetch_stats
 
 app = Flask(__name__)
 init_db()
 
+# Compiled templates survive restarts; HTML responses are gzip/br-compressed
+JINJA_CACHE_DIR = ".jinja_cache"
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+Compress(app)
+DASHBOARD_TEMPLATE = os.path.join(app.root_path, app.template_folder, "dashboard.html")
 
-def ingest_latest():
+# Bounded so parallel ingest doesn't trip Gemini rate limits
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "16"))
+INGEST_INTERVAL_SECONDS = int(os.getenv("INGEST_INTERVAL_SECONDS", "60"))
+INGEST_SCHEDULER = os.getenv("INGEST_SCHEDULER", "0") == "1"
+
+scheduler = BackgroundScheduler(daemon=True)
+
+
+def ingest_latest(force=False):
     """
     Fetch recent support emails via IMAP (or dataset fallback), analyze, generate reply,
     sort by priority (urgent first) and upsert into DB.
+    Emails already stored (by message_id) are skipped unless force=True.
     """
     raw_emails = fetch_support_emails(max_count=100)  # returns list of dicts with message_id/sender/subject/body/received_at
-    processed = []
+    known_ids = set() if force else fetch_message_ids()
 
+    pending = []
     for e in raw_emails:
-        # ensure required keys exist
-        message_id = e.get("message_id") or f"{e.get('sender')}_{e.get('subject')}_{hash(e.get('body',''))}"
-        e_norm = {
+        subject = e.get("subject", "") or ""
+        body = e.get("body", "") or ""
+        body_hash = content_hash(subject, body)
+        # ensure required keys exist; fallback id must be stable across processes
+        message_id = e.get("message_id") or f"{e.get('sender')}_{subject}_{body_hash[:16]}"
+        if message_id in known_ids:
+            continue
+        received_at = e.get("received_at") or datetime.utcnow().isoformat()
+        # received_at might be ISO string — parse once here for the sort below, fallback to 0
+        try:
+            ts_key = -datetime.fromisoformat(received_at).timestamp()
+        except Exception:
+            ts_key = 0
+        pending.append({
             "message_id": message_id,
             "sender": e.get("sender", ""),
-            "subject": e.get("subject", "") or "",
-            "body": e.get("body", "") or "",
-            "received_at": e.get("received_at") or datetime.utcnow().isoformat()
-        }
+            "subject": subject,
+            "body": body,
+            "received_at": received_at,
+            "body_hash": body_hash,
+            "ts_key": ts_key,
+        })
+
+    # one batched LLM analysis pass for the whole ingest
+    analyses = analyze_emails_batch(pending)
 
-        analysis = analyze_email(e_norm)
+    def _process(e_norm, analysis):
         draft = generate_response(e_norm, analysis)
 
-        rec = {
+        return {
             "message_id": e_norm["message_id"],
             "sender": e_norm["sender"],
             "subject": e_norm["subject"],
@@ -43,65 +83,81 @@ def ingest_latest():
             "requirements": analysis.get("requirements", ""),
             "contacts": analysis.get("contacts", ""),
             "draft_reply": draft,
-            "status": "pending"
+            "status": "pending",
+            "body_hash": e_norm["body_hash"],
+            "_sort_key": (0 if analysis.get("priority") == "Urgent" else 1, e_norm["ts_key"]),
         }
-        processed.append(rec)
 
-    # Priority queue: urgent first, then by newest received_at
-    def sort_key(r):
-        pri = 0 if r.get("priority") == "Urgent" else 1
-        # received_at might be ISO string — attempt to parse, fallback to 0
-        try:
-            ts = datetime.fromisoformat(r.get("received_at"))
-            ts_key = -ts.timestamp()
-        except Exception:
-            ts_key = 0
-        return (pri, ts_key)
+    # reply generation is dominated by Gemini round-trips, so overlap them across threads
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+        processed = list(executor.map(_process, pending, analyses))
 
-    processed.sort(key=sort_key)
+    # Priority queue: urgent first, then by newest received_at
+    processed.sort(key=itemgetter("_sort_key"))
+    for rec in processed:
+        del rec["_sort_key"]
 
     if processed:
         upsert_emails(processed)
 
 
+def start_scheduler():
+    """
+    Run ingest_latest in a background thread: once right away, then every INGEST_INTERVAL_SECONDS.
+    """
+    scheduler.add_job(
+        ingest_latest, "interval", seconds=INGEST_INTERVAL_SECONDS, id="ingest_latest",
+        next_run_time=datetime.now(), max_instances=1, coalesce=True, replace_existing=True,
+    )
+    if not scheduler.running:
+        scheduler.start()
+
+
 @app.route("/")
 def dashboard():
-    # Ingest before showing (idempotent due to DB upsert by message_id)
-    ingest_latest()
+    # Served from the DB only; ingest runs on the background scheduler (or POST /refresh)
+    stats = fetch_stats()
+
+    # The counters plus data_version (bumped on every upsert, including forced re-ingests)
+    # change whenever the table does, and the template mtime covers deploys, so an unchanged
+    # ETag lets repeat loads skip the query and render entirely.
+    # Weak, because Flask-Compress serves several encodings of the same page.
+    template_mtime = os.stat(DASHBOARD_TEMPLATE).st_mtime_ns
+    etag = hashlib.sha1(json.dumps([stats, template_mtime], sort_keys=True).encode()).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        not_modified = Response(status=304)
+        not_modified.set_etag(etag, weak=True)
+        return not_modified
 
     emails = fetch_emails(order_by_priority=True)
 
-    # Stats
-    now = datetime.utcnow()
-    last_24h_cutoff = now - timedelta(hours=24)
-
-    def parse_iso(s):
-        try:
-            return datetime.fromisoformat(s)
-        except Exception:
-            return None
-
-    total = len(emails)
-    urgent = sum(1 for e in emails if e.get("priority") == "Urgent")
-    positive = sum(1 for e in emails if e.get("sentiment") == "Positive")
-    negative = sum(1 for e in emails if e.get("sentiment") == "Negative")
-    neutral = sum(1 for e in emails if e.get("sentiment") == "Neutral")
-    last_24 = sum(1 for e in emails if (parse_iso(e.get("received_at")) or now) >= last_24h_cutoff)
-    resolved = sum(1 for e in emails if e.get("status") == "resolved")
-    pending = total - resolved
-
-    stats = {
-        "total": total,
-        "urgent": urgent,
-        "positive": positive,
-        "negative": negative,
-        "neutral": neutral,
-        "last_24h": last_24,
-        "resolved": resolved,
-        "pending": pending,
-    }
-
-    return render_template("dashboard.html", emails=emails, stats=stats)
+    response = Response(render_template("dashboard.html", emails=emails, stats=stats))
+    response.set_etag(etag, weak=True)
+    return response
+
+
+@app.route("/refresh", methods=["POST"])
+def refresh():
+    # Manual ingest trigger: pull the scheduled job forward instead of ingesting in the request,
+    # so it never overlaps a scheduled run (max_instances=1) and the redirect is immediate
+    if scheduler.get_job("ingest_latest"):
+        scheduler.modify_job("ingest_latest", next_run_time=datetime.now())
+    else:
+        # no periodic ingest in this process; run once in the background
+        scheduler.add_job(ingest_latest, id="ingest_latest", max_instances=1, replace_existing=True)
+        if not scheduler.running:
+            scheduler.start()
+    return redirect(url_for("dashboard"))
+
+
+# Periodic ingest is opt-in (INGEST_SCHEDULER=1) so tests, `flask shell` and every extra
+# gunicorn worker don't each start polling IMAP; enable it in exactly one process.
+# `python app.py` and `flask run --debug` both import this module in a reloader parent that
+# only watches files, then re-execute it in a serving child (WERKZEUG_RUN_MAIN=true); only that
+# child, or a non-debug server (WSGI / plain `flask run`) importing the module, should schedule ingest.
+_reloader_child = os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+if INGEST_SCHEDULER and (_reloader_child or (__name__ != "__main__" and not app.debug)):
+    start_scheduler()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,12 @@
+import asyncio
+import csv
+import html
 import imaplib
-import email
-from email.header import decode_header
+import re
+from datetime import datetime
+from email import policy
+from email.parser import BytesParser
+from pathlib import Path
 import os
 
 IMAP_SERVER = "imap.gmail.com"
@@ -9,54 +15,188 @@ EMAIL_USER = os.getenv("EMAIL_USER")  # your Gmail address
 EMAIL_PASS = os.getenv("EMAIL_PASS")  # App Password
 
 FILTER_KEYWORDS = ["support", "query", "request", "help"]
+FETCH_BATCH_SIZE = 100  # max UIDs per FETCH command
+IMAP_CONNECTIONS = int(os.getenv("IMAP_CONNECTIONS", "3"))  # parallel fetch connections (Gmail allows 15)
 
-def load_emails_from_gmail(limit=20):
+DATASET_PATH = Path("dataset.csv")  # demo data used when no mailbox is configured
+
+_PARSER = BytesParser(policy=policy.default)
+
+# HTML-only messages: drop script/style blocks, turn line-level tags into newlines, strip the rest
+_HTML_SKIP_RE = re.compile(r"<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_HTML_BREAK_RE = re.compile(r"<(?:br|/p|/div|/li|/tr|/h[1-6])\b[^>]*>", re.IGNORECASE)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+
+
+def _html_to_text(markup):
+    text = _HTML_SKIP_RE.sub("", markup)
+    text = _HTML_BREAK_RE.sub("\n", text)
+    text = html.unescape(_HTML_TAG_RE.sub("", text))
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+def _subject_search_criteria(keywords):
     """
-    Fetch emails from Gmail via IMAP.
-    Returns: list of dicts with sender, subject, body, date
+    Build an IMAP SEARCH matching any keyword in the subject.
+    IMAP OR is binary, so N keywords nest as: OR SUBJECT "a" OR SUBJECT "b" SUBJECT "c"
     """
-    mails = []
+    terms = [f'SUBJECT "{kw}"' for kw in keywords]
+    criteria = terms[-1]
+    for term in reversed(terms[:-1]):
+        criteria = f"OR {term} {criteria}"
+    return f"({criteria})"
+
+
+def _parse_message(raw):
+    """
+    Turn a raw RFC822 message into our dict shape; None if it doesn't pass the keyword filter.
+    """
+    msg = _PARSER.parsebytes(raw)
+
+    # headers are already decoded to str under policy.default
+    subject = str(msg["Subject"] or "")
+
+    # Server-side SEARCH already filtered; keep the local check as a guard
+    if not any(kw.lower() in subject.lower() for kw in FILTER_KEYWORDS):
+        return None
+
+    message_id = msg["Message-ID"]
+    sender = str(msg["From"] or "")
+    date_header = msg["Date"]
+    date = str(date_header or "")
+    parsed_date = getattr(date_header, "datetime", None)
+    received_at = parsed_date.isoformat() if parsed_date else None
+
+    # Get email body: text/plain preferred; HTML-only messages are reduced to their text
+    body = ""
+    body_part = msg.get_body(preferencelist=("plain", "html"))
+    if body_part is not None:
+        try:
+            body = body_part.get_content()
+        except Exception:
+            # unknown/bogus charset
+            body = (body_part.get_payload(decode=True) or b"").decode("utf-8", errors="ignore")
+        if body_part.get_content_subtype() == "html":
+            body = _html_to_text(body)
+
+    return {
+        "message_id": str(message_id) if message_id else None,
+        "sender": sender,
+        "subject": subject,
+        "body": body,
+        "date": date,
+        "received_at": received_at
+    }
+
+
+def _open_connection():
+    conn = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
+    conn.login(EMAIL_USER, EMAIL_PASS)
+    conn.select("inbox")
+    return conn
+
+
+def _search_uids(limit):
+    """
+    UIDs of the last `limit` inbox messages whose subject matches FILTER_KEYWORDS (server-side filter).
+    """
+    conn = _open_connection()
     try:
-        conn = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
-        conn.login(EMAIL_USER, EMAIL_PASS)
-        conn.select("inbox")
-
-        # Search all emails
-        status, messages = conn.search(None, "ALL")
-        email_ids = messages[0].split()[-limit:]  # last N emails
-
-        for eid in reversed(email_ids):
-            _, msg_data = conn.fetch(eid, "(RFC822)")
-            msg = email.message_from_bytes(msg_data[0][1])
-
-            subject, encoding = decode_header(msg["Subject"])[0]
-            if isinstance(subject, bytes):
-                subject = subject.decode(encoding or "utf-8", errors="ignore")
-
-            sender = msg.get("From", "")
-            date = msg.get("Date", "")
-
-            # Get email body
-            body = ""
-            if msg.is_multipart():
-                for part in msg.walk():
-                    if part.get_content_type() == "text/plain":
-                        body = part.get_payload(decode=True).decode("utf-8", errors="ignore")
-                        break
-            else:
-                body = msg.get_payload(decode=True).decode("utf-8", errors="ignore")
-
-            # Apply keyword filter
-            if any(kw.lower() in subject.lower() for kw in FILTER_KEYWORDS):
-                mails.append({
-                    "sender": sender,
-                    "subject": subject,
-                    "body": body,
-                    "date": date
-                })
+        status, messages = conn.uid("search", None, _subject_search_criteria(FILTER_KEYWORDS))
+        return messages[0].split()[-limit:]
+    finally:
+        conn.logout()
+
 
+def _fetch_uids(uids):
+    """
+    Download raw RFC822 messages for `uids` on a dedicated connection, FETCH_BATCH_SIZE ids per command.
+    """
+    conn = _open_connection()
+    try:
+        raw_messages = []
+        for i in range(0, len(uids), FETCH_BATCH_SIZE):
+            batch = b",".join(uids[i:i + FETCH_BATCH_SIZE]).decode()
+            _, msg_data = conn.uid("fetch", batch, "(RFC822)")
+            # response interleaves (envelope, literal) tuples with b")" terminators
+            raw_messages.extend(item[1] for item in msg_data if isinstance(item, tuple))
+        return raw_messages
+    finally:
         conn.logout()
+
+
+async def load_emails_from_gmail(limit=20, connections=IMAP_CONNECTIONS):
+    """
+    Fetch emails from Gmail via IMAP.
+    Subject filtering runs server-side (UID SEARCH); the matching UIDs are split into
+    `connections` contiguous chunks that are downloaded concurrently, each on its own
+    IMAP connection, so transfer isn't bound by a single connection's round-trips.
+    Returns: list of dicts with message_id, sender, subject, body, date, received_at (newest first)
+    """
+    mails = []
+    try:
+        uids = await asyncio.to_thread(_search_uids, limit)
     except Exception as e:
         print("Email fetch error:", e)
+        return mails
+    if not uids:
+        return mails
+
+    k = max(1, min(connections, len(uids)))
+    size = -(-len(uids) // k)
+    chunks = [uids[i:i + size] for i in range(0, len(uids), size)]
+    results = await asyncio.gather(
+        *(asyncio.to_thread(_fetch_uids, chunk) for chunk in chunks),
+        return_exceptions=True,
+    )
+
+    raw_messages = []
+    for result in results:
+        if isinstance(result, Exception):
+            print("Email fetch error:", result)
+            continue
+        raw_messages.extend(result)
+
+    for raw in reversed(raw_messages):
+        try:
+            mail = _parse_message(raw)
+        except Exception as e:
+            print("Email parse error:", e)
+            continue
+        if mail:
+            mails.append(mail)
 
     return mails
+
+
+def load_emails_from_dataset(limit=20):
+    """
+    Demo fallback: read emails from dataset.csv (sender, subject, body, sent_date).
+    """
+    mails = []
+    try:
+        with DATASET_PATH.open(encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                try:
+                    received_at = datetime.strptime(row.get("sent_date", ""), "%Y-%m-%d %H:%M:%S").isoformat()
+                except ValueError:
+                    received_at = None
+                mails.append({
+                    "sender": row.get("sender", ""),
+                    "subject": row.get("subject", ""),
+                    "body": row.get("body", ""),
+                    "date": row.get("sent_date", ""),
+                    "received_at": received_at
+                })
+    except Exception as e:
+        print("Dataset load error:", e)
+    return mails[-limit:]
+
+
+def fetch_support_emails(max_count=100):
+    """
+    Synchronous entry point used by the app: IMAP if EMAIL_USER/EMAIL_PASS are set, else dataset.csv.
+    """
+    if EMAIL_USER and EMAIL_PASS:
+        return asyncio.run(load_emails_from_gmail(limit=max_count))
+    return load_emails_from_dataset(limit=max_count)
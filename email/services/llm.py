@@ -0,0 +1,101 @@
+# services/llm.py
+import os
+import threading
+import time
+
+from utils.llm_cache import get_or_call
+
+GEMINI_MODEL = "gemini-2.0-flash"
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))  # requests/minute allowed to reach the API; <= 0 disables
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "5"))
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket: `rate_per_minute` tokens refill continuously up to `burst`,
+    and acquire() blocks until one is available.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                time.sleep((1 - self._tokens) / self.rate)
+
+
+# Shared by nlp_service and response_service so every Gemini request counts against one budget
+_limiter = RateLimiter(GEMINI_RPM, GEMINI_BURST)
+
+# Gemini client, created lazily on first use and shared by every call (and ingest thread)
+_genai = None
+_model = None
+_client_lock = threading.Lock()
+
+
+def _get_model():
+    """
+    Configure google-generativeai and build the Gemini model once per process.
+    Returns the GenerativeModel, or None on older SDKs that only offer generate_text.
+    """
+    global _genai, _model
+    if _genai is None:
+        with _client_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+                if hasattr(genai, "GenerativeModel"):
+                    _model = genai.GenerativeModel(GEMINI_MODEL)
+                _genai = genai
+    return _model
+
+
+def _call_gemini(prompt: str, max_tokens: int = 512) -> str | None:
+    """
+    Attempt to call Gemini (google-generativeai). Returns text or None on failure.
+    """
+    try:
+        model = _get_model()
+        _limiter.acquire()
+        if model is not None:
+            out = model.generate_content(prompt)
+            return getattr(out, "text", None) or str(out)
+
+        if hasattr(_genai, "generate_text"):
+            resp = _genai.generate_text(model=GEMINI_MODEL, prompt=prompt, max_output_tokens=max_tokens)
+            # handle common shapes
+            if isinstance(resp, dict):
+                if "candidates" in resp and resp["candidates"]:
+                    return resp["candidates"][0].get("content") or resp["candidates"][0].get("text")
+                return str(resp)
+            return getattr(resp, "text", str(resp))
+
+    except Exception as e:
+        # print only in debug; callers fall back to heuristics
+        print("Gemini call failed:", str(e))
+        return None
+
+    return None
+
+
+def call_gemini(prompt: str, max_tokens: int = 512, semantic_text: str = None, scope: str = "") -> str | None:
+    """
+    Cached, rate-limited Gemini call shared by all services. Returns text or None on failure.
+    Pass `semantic_text`/`scope` only for free-text prompts that may reuse a near-duplicate
+    answer (see utils.llm_cache.get_or_call); everything else is exact-match cached.
+    """
+    return get_or_call(prompt, lambda p: _call_gemini(p, max_tokens=max_tokens),
+                       semantic_text=semantic_text, scope=scope)
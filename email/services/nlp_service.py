@@ -2,53 +2,88 @@
 import os
 import re
 import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from services.llm import call_gemini
 
 # ------- Heuristic wordlists -------
 POS_WORDS = {"great", "thanks", "thank you", "appreciate", "love", "awesome", "good"}
 NEG_WORDS = {"issue", "problem", "angry", "frustrated", "not working", "cannot", "error", "fail"}
 URGENT_WORDS = {"urgent", "immediately", "asap", "critical", "cannot access", "down", "outage", "blocked"}
+REQUIREMENT_KEYS = ("need", "require", "want", "request", "help", "cannot", "unable", "fix", "access", "please")
+
+# keyword group bits, OR-ed together by a single scan of each email
+POS, NEG, URG, REQ = 1, 2, 4, 8
 
 EMAIL_REGEX = r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}"
 PHONE_REGEX = r"(?:\+?\d[\s-]?)?(?:\(?\d{3}\)?[\s-]?)?\d{3}[\s-]?\d{4}"
 
+# compiled once at import; used for every email
+_EMAIL_RE = re.compile(EMAIL_REGEX)
+_PHONE_RE = re.compile(PHONE_REGEX)
+_SENT_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.S)
+_JSON_ARRAY_RE = re.compile(r"\[.*\]", re.S)
+
+# max emails per batched Gemini analysis prompt (keeps request/response under token limits)
+ANALYSIS_BATCH_SIZE = 20
 
-# ------- Optional Gemini wrapper (robust to different client versions) -------
-def _call_gemini(prompt: str, max_tokens: int = 512) -> str | None:
+
+# ------- Heuristic functions -------
+def _build_automaton():
     """
-    Attempt to call Gemini (google-generativeai). Returns text or None on failure.
+    Build one Aho-Corasick automaton over every keyword group (pyahocorasick).
+    Returns None if the package is missing; _keyword_mask then falls back to substring scans.
     """
     try:
-        import google.generativeai as genai
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-        # try a couple of likely client APIs (best-effort)
-        if hasattr(genai, "generate_text"):
-            resp = genai.generate_text(model="gemini-2.0-flash", prompt=prompt, max_output_tokens=max_tokens)
-            # handle common shapes
-            if isinstance(resp, dict):
-                if "candidates" in resp and resp["candidates"]:
-                    return resp["candidates"][0].get("content") or resp["candidates"][0].get("text")
-                return str(resp)
-            return getattr(resp, "text", str(resp))
-
-        if hasattr(genai, "GenerativeModel"):
-            model = genai.GenerativeModel("gemini-2.0-flash")
-            out = model.generate_content(prompt)
-            return getattr(out, "text", None) or str(out)
-
-    except Exception as e:
-        # print only in debug; fallback to heuristics
-        print("Gemini call failed:", str(e))
+        import ahocorasick
+    except ImportError:
         return None
 
-    return None
+    groups = {}
+    for bit, words in ((POS, POS_WORDS), (NEG, NEG_WORDS), (URG, URGENT_WORDS), (REQ, REQUIREMENT_KEYS)):
+        for w in words:
+            groups[w] = groups.get(w, 0) | bit  # a word may belong to several groups ("cannot")
+    automaton = ahocorasick.Automaton()
+    for w, bits in groups.items():
+        automaton.add_word(w, (bits, w))
+    automaton.make_automaton()
+    return automaton
 
 
-# ------- Heuristic functions -------
-def _sentiment(text: str) -> str:
-    tl = (text or "").lower()
-    pos = any(w in tl for w in POS_WORDS)
-    neg = any(w in tl for w in NEG_WORDS)
+_AUTOMATON = _build_automaton()
+
+
+def _keyword_mask(subject: str, body: str) -> int:
+    """
+    Scan subject+body once and return the POS/NEG/URG/REQ bits that matched.
+    REQ only counts when the keyword occurs in the body.
+    """
+    subject_l = subject.lower()
+    text = subject_l + "\n" + body.lower()
+    body_start = len(subject_l) + 1
+
+    mask = 0
+    if _AUTOMATON is not None:
+        for end, (bits, word) in _AUTOMATON.iter(text):
+            if bits & REQ and end - len(word) + 1 < body_start:
+                bits &= ~REQ
+            mask |= bits
+        return mask
+
+    for bit, words in ((POS, POS_WORDS), (NEG, NEG_WORDS), (URG, URGENT_WORDS)):
+        if any(w in text for w in words):
+            mask |= bit
+    if any(k in text[body_start:] for k in REQUIREMENT_KEYS):
+        mask |= REQ
+    return mask
+
+
+def _sentiment(mask: int) -> str:
+    pos = bool(mask & POS)
+    neg = bool(mask & NEG)
     if pos and not neg:
         return "Positive"
     if neg and not pos:
@@ -56,14 +91,70 @@ def _sentiment(text: str) -> str:
     return "Neutral"
 
 
-def _priority(text: str) -> str:
-    tl = (text or "").lower()
-    return "Urgent" if any(w in tl for w in URGENT_WORDS) else "Not urgent"
+def _priority(mask: int) -> str:
+    return "Urgent" if mask & URG else "Not urgent"
+
+
+# Hyperscan prefilters (bytes, matched against UTF-8): each fires on every text where the
+# corresponding `re` pattern could match, so a miss lets us skip that findall entirely.
+#  0: EMAIL_REGEX itself - it only uses ASCII classes, so bytes and str matching agree
+#  1: four consecutive "digits", where any multibyte UTF-8 char counts as a possible
+#     non-ASCII \d; every PHONE_REGEX match ends in \d{4}
+_CONTACT_PREFILTERS = [EMAIL_REGEX, r"(?:[0-9]|[\xc0-\xff][\x80-\xbf]+){4}"]
+
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+
+def _build_contact_db():
+    """
+    Compile the contact prefilters into one Hyperscan database (ids 0 and 1).
+    Returns None if the hyperscan binding is unavailable; callers then always use `re`.
+    """
+    if hyperscan is None:
+        return None
+    try:
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[p.encode() for p in _CONTACT_PREFILTERS],
+            ids=[0, 1],
+            flags=[hyperscan.HS_FLAG_SINGLEMATCH] * 2,
+        )
+        return db
+    except Exception:
+        return None
+
+
+_CONTACT_DB = _build_contact_db()
+_hs_local = threading.local()  # scratch space is per-thread; ingest analyzes emails concurrently
+
+
+def _hs_detect(text: str) -> tuple[bool, bool]:
+    """
+    One Hyperscan pass over `text`: (email may be present, phone may be present).
+    """
+    scratch = getattr(_hs_local, "scratch", None)
+    if scratch is None:
+        scratch = _hs_local.scratch = hyperscan.Scratch(_CONTACT_DB)
+
+    hits = [False, False]
+
+    def on_match(pid, start, end, flags, context):
+        hits[pid] = True
+
+    _CONTACT_DB.scan(text.encode("utf-8", errors="surrogatepass"), match_event_handler=on_match, scratch=scratch)
+    return hits[0], hits[1]
 
 
 def _extract_contacts(text: str) -> str:
-    emails = re.findall(EMAIL_REGEX, text or "")
-    phones = re.findall(PHONE_REGEX, text or "")
+    text = text or ""
+    has_email, has_phone = _hs_detect(text) if _CONTACT_DB is not None and text else (True, True)
+    # extraction itself always uses `re`, so results are identical with or without hyperscan
+    emails = _EMAIL_RE.findall(text) if has_email else []
+    phones = _PHONE_RE.findall(text) if has_phone else []
     parts = []
     if emails:
         parts.append("Emails: " + ", ".join(sorted(set(emails))[:3]))
@@ -75,13 +166,77 @@ def _extract_contacts(text: str) -> str:
 def _extract_requirements(text: str) -> str:
     if not text:
         return ""
-    sentences = re.split(r"(?<=[.!?])\s+", text.strip())
-    keys = ("need", "require", "want", "request", "help", "cannot", "unable", "fix", "access", "please")
-    reqs = [s for s in sentences if any(k in s.lower() for k in keys)]
+    sentences = _SENT_SPLIT.split(text.strip())
+    reqs = [s for s in sentences if any(k in s.lower() for k in REQUIREMENT_KEYS)]
     return " ".join(reqs[:3])
 
 
+# LRU of heuristic results keyed by a digest of (subject, body), so the cache holds
+# 32-byte keys rather than keeping full email bodies alive
+ANALYSIS_CACHE_SIZE = 4096
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+
+def _analyze_core(subject: str, body: str) -> tuple:
+    """
+    Heuristic analysis memoized on a (subject, body) hash so repeat ingests of the same email are free.
+    Returns an immutable (sentiment, priority, requirements, contacts) tuple.
+    """
+    key = hashlib.sha256(f"{subject}\0{body}".encode("utf-8", errors="surrogatepass")).digest()
+    with _analysis_cache_lock:
+        cached = _analysis_cache.get(key)
+        if cached is not None:
+            _analysis_cache.move_to_end(key)
+            return cached
+
+    mask = _keyword_mask(subject, body)
+    result = (
+        _sentiment(mask),
+        _priority(mask),
+        # sentence splitting is only worth doing when a requirement keyword is present
+        _extract_requirements(body) if mask & REQ else "",
+        _extract_contacts(body),
+    )
+    with _analysis_cache_lock:
+        _analysis_cache[key] = result
+        if len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+    return result
+
+
 # ------- Public API -------
+def content_hash(subject: str, body: str) -> str:
+    """
+    Stable SHA-256 of the whitespace/case-normalized subject and body.
+    Stored alongside each email so stale analyses can be detected later.
+    """
+    norm = " ".join((subject or "").lower().split()) + "\n" + " ".join((body or "").lower().split())
+    return hashlib.sha256(norm.encode("utf-8")).hexdigest()
+
+
+def _heuristic_analysis(email_obj: dict) -> dict:
+    subject = email_obj.get("subject", "") or ""
+    body = email_obj.get("body", "") or ""
+    sentiment, priority, requirements, contacts = _analyze_core(subject, body)
+    return {
+        "sentiment": sentiment,
+        "priority": priority,
+        "requirements": requirements,
+        "contacts": contacts,
+    }
+
+
+def _merge_llm(parsed: dict, result: dict) -> dict:
+    """Take the model's fields where present, keeping heuristic values for anything missing."""
+    return {
+        "priority": parsed.get("priority") or result["priority"],
+        "sentiment": parsed.get("sentiment") or result["sentiment"],
+        "requirements": parsed.get("requirements") or result["requirements"],
+        "contacts": parsed.get("contacts") or result["contacts"],
+    }
+
+
 def analyze_email(email_obj: dict) -> dict:
     """
     Analyze an email and return:
@@ -90,15 +245,9 @@ def analyze_email(email_obj: dict) -> dict:
     """
     subject = email_obj.get("subject", "") or ""
     body = email_obj.get("body", "") or ""
-    combined = (subject + "\n" + body).strip()
 
     # heuristic baseline
-    result = {
-        "sentiment": _sentiment(combined),
-        "priority": _priority(combined),
-        "requirements": _extract_requirements(body),
-        "contacts": _extract_contacts(body),
-    }
+    result = _heuristic_analysis(email_obj)
 
     # If user configured Gemini, try to get a refined JSON from the model
     if os.getenv("GEMINI_API_KEY"):
@@ -116,22 +265,71 @@ Body: {body}
 
 Return *only* a JSON object.
 """
-        raw = _call_gemini(prompt, max_tokens=250)
+        raw = call_gemini(prompt, max_tokens=250)
         if raw:
             # try to extract JSON substring
             try:
-                m = re.search(r"\{.*\}", raw, re.S)
+                m = _JSON_OBJECT_RE.search(raw)
                 jtxt = m.group(0) if m else raw
                 parsed = json.loads(jtxt)
-                # validate parsed keys and normalize
-                out = {}
-                out["priority"] = parsed.get("priority") or result["priority"]
-                out["sentiment"] = parsed.get("sentiment") or result["sentiment"]
-                out["requirements"] = parsed.get("requirements") or result["requirements"]
-                out["contacts"] = parsed.get("contacts") or result["contacts"]
-                return out
+                return _merge_llm(parsed, result)
             except Exception:
                 # fall back to heuristic
                 pass
 
     return result
+
+
+def analyze_emails_batch(emails: list[dict]) -> list[dict]:
+    """
+    Analyze many emails at once; returns one analysis dict per input email, in order.
+    With GEMINI_API_KEY set, emails are sent ANALYSIS_BATCH_SIZE at a time as a numbered JSON array
+    (one LLM round-trip per chunk instead of per email). Emails the model skips or mangles keep
+    their heuristic analysis.
+    """
+    results = [_heuristic_analysis(e) for e in emails]
+    if not os.getenv("GEMINI_API_KEY"):
+        return results
+
+    for start in range(0, len(emails), ANALYSIS_BATCH_SIZE):
+        chunk = emails[start:start + ANALYSIS_BATCH_SIZE]
+        items = [
+            {"index": i, "subject": e.get("subject", "") or "", "body": e.get("body", "") or ""}
+            for i, e in enumerate(chunk)
+        ]
+        prompt = f"""
+You are an assistant that extracts metadata from support emails.
+Analyze each email in the JSON array below and return a valid JSON array with one object per email.
+Each object must have exactly these keys:
+- "index": the index of the email it describes
+- "priority": one of ["Urgent", "Not urgent"]
+- "sentiment": one of ["Positive", "Negative", "Neutral"]
+- "requirements": short text summarizing the customer's request (1-2 sentences)
+- "contacts": comma-separated contact info (emails, phones) if present
+
+Emails:
+{json.dumps(items, ensure_ascii=False, indent=2)}
+
+Return *only* a JSON array.
+"""
+        raw = call_gemini(prompt, max_tokens=250 * len(chunk))
+        if not raw:
+            continue
+        try:
+            m = _JSON_ARRAY_RE.search(raw)
+            parsed = json.loads(m.group(0) if m else raw)
+        except Exception:
+            # keep heuristics for this chunk
+            continue
+        if not isinstance(parsed, list):
+            continue
+
+        for pos, item in enumerate(parsed):
+            if not isinstance(item, dict):
+                continue
+            idx = item.get("index", pos)
+            # type() rather than isinstance(): JSON true/false arrive as bool, a subclass of int
+            if type(idx) is int and 0 <= idx < len(chunk):
+                results[start + idx] = _merge_llm(item, results[start + idx])
+
+    return results
@@ -1,69 +1,80 @@
 # services/response_service.py
 import os
-import glob
 import re
-import json
+import threading
 from pathlib import Path
 
-KB_DIR = Path("knowledge_base")  # folder containing .txt files to be used for RAG
-
-
-def _call_gemini(prompt: str, max_tokens: int = 512) -> str | None:
-    """
-    Best-effort Gemini wrapper. Returns generated text or None.
-    (Same strategy used in nlp_service; duplicated so this file can be used standalone)
-    """
-    try:
-        import google.generativeai as genai
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+from services.llm import call_gemini
+from utils.kb_index import candidate_docs, load_index, search, tokenize
 
-        if hasattr(genai, "generate_text"):
-            resp = genai.generate_text(model="gemini-2.0-flash", prompt=prompt, max_output_tokens=max_tokens)
-            if isinstance(resp, dict):
-                if "candidates" in resp and resp["candidates"]:
-                    return resp["candidates"][0].get("content") or resp["candidates"][0].get("text")
-                return str(resp)
-            return getattr(resp, "text", str(resp))
+KB_DIR = Path("knowledge_base")  # folder containing .txt files to be used for RAG
 
-        if hasattr(genai, "GenerativeModel"):
-            model = genai.GenerativeModel("gemini-2.0-flash")
-            out = model.generate_content(prompt)
-            return getattr(out, "text", None) or str(out)
+# Order numbers, phones, amounts and addresses a reply may quote back to the customer
+_SPECIFICS_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+|\d+")
 
-    except Exception as e:
-        print("Gemini call failed:", e)
-        return None
 
-    return None
+# TF-IDF model over the KB index's documents, refit only when the KB files change
+_tfidf_lock = threading.Lock()
+_tfidf = None
 
 
-def _tokenize(text: str):
-    return re.findall(r"\w+", (text or "").lower())
+def _load_tfidf(index):
+    """
+    Return (vectorizer, matrix) fitted on the index's documents, or None if scikit-learn
+    is unavailable or the KB has no usable terms.
+    """
+    global _tfidf
+    state = _tfidf
+    if state is None or state["signature"] != index["signature"]:
+        with _tfidf_lock:
+            state = _tfidf
+            if state is None or state["signature"] != index["signature"]:
+                state = {"signature": index["signature"], "model": None}
+                try:
+                    from sklearn.feature_extraction.text import TfidfVectorizer
+                    vectorizer = TfidfVectorizer(ngram_range=(1, 2))
+                    state["model"] = (vectorizer, vectorizer.fit_transform(index["doc_texts"]))
+                except (ImportError, ValueError):
+                    # no scikit-learn, or every document is empty
+                    pass
+                _tfidf = state
+    return state["model"]
 
 
 def retrieve_relevant_kb(email_body: str, top_k: int = 3):
     """
-    Naive retrieval: load all .txt files in knowledge_base, score them by word overlap, return top_k texts.
+    TF-IDF retrieval over knowledge_base/*.txt: the inverted index in utils/kb_index.py narrows
+    the KB to documents sharing a word with the email, which are scored with one sparse mat-vec
+    product, and the top_k texts are returned. Without scikit-learn, those documents are ranked
+    by shared words instead.
     """
-    email_tokens = set(_tokenize(email_body))
-    if not email_tokens or not KB_DIR.exists():
+    if not (email_body or "").strip() or top_k <= 0:
+        return []
+    index = load_index(KB_DIR)
+    if not index["doc_texts"]:
         return []
 
-    candidates = []
-    for path in KB_DIR.glob("*.txt"):
-        try:
-            txt = path.read_text(encoding="utf-8", errors="ignore")
-        except Exception:
-            continue
-        doc_tokens = set(_tokenize(txt))
-        # score = overlap ratio
-        overlap = email_tokens.intersection(doc_tokens)
-        score = len(overlap)
-        if score > 0:
-            candidates.append((score, txt, path.name))
-    # sort by score desc
-    candidates.sort(key=lambda x: x[0], reverse=True)
-    return [{"score": c[0], "text": c[1], "source": c[2]} for c in candidates[:top_k]]
+    query_tokens = tokenize(email_body)
+    model = _load_tfidf(index)
+    if model is not None:
+        import numpy as np
+
+        # a document with no shared word scores 0, so only the candidates need scoring
+        rows = np.fromiter(sorted(candidate_docs(index, query_tokens)), dtype=np.intp)
+        if rows.size == 0:
+            return []
+        vectorizer, matrix = model
+        qv = vectorizer.transform([email_body])
+        # rows are L2-normalized, so this is cosine similarity
+        scores = (matrix[rows] @ qv.T).toarray().ravel()
+        k = min(top_k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        ranked = [(float(scores[i]), int(rows[i])) for i in top if scores[i] > 0]
+    else:
+        ranked = search(index, query_tokens, top_k)
+
+    return [{"score": score, "text": index["doc_texts"][i], "source": index["doc_names"][i]} for score, i in ranked]
 
 
 def generate_response(email_obj: dict, analysis: dict) -> str:
@@ -101,7 +112,11 @@ def generate_response(email_obj: dict, analysis: dict) -> str:
 
     # 3) If Gemini available, call it
     if os.getenv("GEMINI_API_KEY"):
-        out = _call_gemini(prompt, max_tokens=400)
+        # near-identical emails answered from the same KB excerpts can share a cached reply,
+        # but only if they carry the same specifics, so no draft quotes another customer's details
+        specifics = _SPECIFICS_RE.findall(f"{subject}\n{body}")
+        scope = "\n".join([kb_text, analysis.get("contacts") or "", " ".join(specifics)])
+        out = call_gemini(prompt, max_tokens=400, semantic_text=f"{subject}\n{body}", scope=scope)
         if out:
             # best-effort cleanup
             return out.strip()
@@ -0,0 +1,24 @@
+# tests/test_email_service.py
+from services.email_service import _parse_message
+
+HEADERS = b"From: a@example.com\r\nSubject: Support needed\r\nMessage-ID: <1@example.com>\r\n"
+
+
+def test_html_only_body_is_converted_to_text():
+    raw = HEADERS + (
+        b"Content-Type: text/html; charset=utf-8\r\n\r\n"
+        b"<html><style>p {color: red}</style><body><p>Order&nbsp;#42 is late</p>"
+        b"<p>Call 555-123-4567</p></body></html>"
+    )
+    assert _parse_message(raw)["body"] == "Order\xa0#42 is late\nCall 555-123-4567"
+
+
+def test_plain_part_preferred_over_html():
+    raw = HEADERS + (
+        b"MIME-Version: 1.0\r\n"
+        b'Content-Type: multipart/alternative; boundary="b"\r\n\r\n'
+        b"--b\r\nContent-Type: text/plain\r\n\r\nplain text\r\n"
+        b"--b\r\nContent-Type: text/html\r\n\r\n<p>html text</p>\r\n"
+        b"--b--\r\n"
+    )
+    assert _parse_message(raw)["body"].strip() == "plain text"
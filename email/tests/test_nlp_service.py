@@ -0,0 +1,43 @@
+# tests/test_nlp_service.py
+import random
+
+import pytest
+
+from services import nlp_service
+
+
+def _contacts_without_hyperscan(monkeypatch, text):
+    with monkeypatch.context() as m:
+        m.setattr(nlp_service, "_CONTACT_DB", None)
+        return nlp_service._extract_contacts(text)
+
+
+@pytest.mark.skipif(nlp_service._CONTACT_DB is None, reason="hyperscan not installed")
+@pytest.mark.parametrize("text", [
+    "Call 555-123-4567 555-987-6543",
+    "Phones: 4155552671 4155552672 +1 415 555 2673",
+    "12345678901234567890",
+    "mail a.b@x.co or c@d.org, call (555) 123 4567",
+    "Arabic-Indic digits: ٥٥٥١٢٣٤٥٦٧",
+    "no contacts here",
+    "",
+])
+def test_hyperscan_contacts_match_re(monkeypatch, text):
+    assert nlp_service._extract_contacts(text) == _contacts_without_hyperscan(monkeypatch, text)
+
+
+@pytest.mark.skipif(nlp_service._CONTACT_DB is None, reason="hyperscan not installed")
+def test_hyperscan_contacts_match_re_random(monkeypatch):
+    rng = random.Random(1)
+    alphabet = "0123456789 -+()@.abcXY_%\n٣"
+    for _ in range(5000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+        assert nlp_service._extract_contacts(text) == _contacts_without_hyperscan(monkeypatch, text), text
+
+
+def test_batch_ignores_boolean_index(monkeypatch):
+    emails = [{"subject": "Hi", "body": "hello"}, {"subject": "Hey", "body": "hello again"}]
+    monkeypatch.setattr(nlp_service, "call_gemini", lambda prompt, **kw: '[{"index": true, "priority": "Urgent"}]')
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    results = nlp_service.analyze_emails_batch(emails)
+    assert [r["priority"] for r in results] == ["Not urgent", "Not urgent"]
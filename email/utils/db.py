@@ -1,58 +1,100 @@
 # utils/db.py
 import sqlite3
-from pathlib import Path
+import threading
+from contextlib import contextmanager
 
 DB_NAME = "emails.db"
+UPSERT_CHUNK_SIZE = 500
+
+EMAIL_COLUMNS = (
+    "message_id", "sender", "subject", "body", "received_at", "priority", "sentiment",
+    "requirements", "contacts", "draft_reply", "status", "body_hash",
+)
+
+# One process-wide connection (autocommit, WAL) shared by all threads; _LOCK serializes its use
+_CONN = None
+_LOCK = threading.Lock()
 
 
 def _connect():
-    Path(DB_NAME).touch(exist_ok=True)
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+    global _CONN
+    if _CONN is None:
+        with _LOCK:
+            if _CONN is None:
+                conn = sqlite3.connect(DB_NAME, check_same_thread=False, isolation_level=None)
+                conn.row_factory = sqlite3.Row
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                _CONN = conn
+    return _CONN
+
+
+@contextmanager
+def locked_connection():
+    """
+    The shared connection, held under the module lock for the duration of the block.
+    For other modules (e.g. utils/llm_cache.py) keeping their own tables in emails.db.
+    """
+    conn = _connect()
+    with _LOCK:
+        yield conn
 
 
 def init_db():
     conn = _connect()
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS emails (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            message_id TEXT UNIQUE,
-            sender TEXT,
-            subject TEXT,
-            body TEXT,
-            received_at TEXT,
-            priority TEXT,
-            sentiment TEXT,
-            requirements TEXT,
-            contacts TEXT,
-            draft_reply TEXT,
-            status TEXT DEFAULT 'pending'
-        )
-    """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_received ON emails(received_at DESC)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_priority ON emails(priority)")
-    conn.commit()
-    conn.close()
+    with _LOCK:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS emails (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id TEXT UNIQUE,
+                sender TEXT,
+                subject TEXT,
+                body TEXT,
+                received_at TEXT,
+                priority TEXT,
+                sentiment TEXT,
+                requirements TEXT,
+                contacts TEXT,
+                draft_reply TEXT,
+                status TEXT DEFAULT 'pending',
+                body_hash TEXT
+            )
+        """)
+        # databases created before body_hash existed
+        cols = {r["name"] for r in cur.execute("PRAGMA table_info(emails)")}
+        if "body_hash" not in cols:
+            cur.execute("ALTER TABLE emails ADD COLUMN body_hash TEXT")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_received ON emails(received_at DESC)")
+        # matches fetch_emails' ORDER BY exactly, so SQLite walks the index instead of sorting
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_pri_recv ON emails(
+                (CASE WHEN priority='Urgent' THEN 0 ELSE 1 END),
+                datetime(received_at) DESC
+            )
+        """)
+        cur.execute("DROP INDEX IF EXISTS idx_priority")
+        # data_version is bumped by every upsert, so the dashboard ETag changes with any write
+        cur.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 0)")
 
 
 def upsert_emails(emails):
     """
     Upsert email records by message_id. Expects a list of dicts with keys:
-    message_id, sender, subject, body, received_at, priority, sentiment, requirements, contacts, draft_reply, status
+    message_id, sender, subject, body, received_at, priority, sentiment, requirements, contacts, draft_reply, status,
+    body_hash
     """
     if not emails:
         return
 
     conn = _connect()
-    cur = conn.cursor()
 
-    sql = """
+    sql = f"""
     INSERT INTO emails
-      (message_id, sender, subject, body, received_at, priority, sentiment, requirements, contacts, draft_reply, status)
+      ({", ".join(EMAIL_COLUMNS)})
     VALUES
-      (:message_id, :sender, :subject, :body, :received_at, :priority, :sentiment, :requirements, :contacts, :draft_reply, :status)
+      ({", ".join("?" * len(EMAIL_COLUMNS))})
     ON CONFLICT(message_id) DO UPDATE SET
       sender=excluded.sender,
       subject=excluded.subject,
@@ -63,11 +105,33 @@ def upsert_emails(emails):
       requirements=excluded.requirements,
       contacts=excluded.contacts,
       draft_reply=excluded.draft_reply,
-      status=excluded.status
+      status=excluded.status,
+      body_hash=excluded.body_hash
+    """
+    # positional tuples, built once, avoid per-row named-parameter lookups
+    rows = [tuple(e[c] for c in EMAIL_COLUMNS) for e in emails]
+
+    # one explicit transaction for the whole batch (the connection is autocommit)
+    with _LOCK:
+        conn.execute("BEGIN")
+        try:
+            for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+                conn.executemany(sql, rows[i:i + UPSERT_CHUNK_SIZE])
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'data_version'")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def fetch_message_ids():
+    """
+    Returns the set of message_ids already stored.
     """
-    cur.executemany(sql, emails)
-    conn.commit()
-    conn.close()
+    conn = _connect()
+    with _LOCK:
+        rows = conn.execute("SELECT message_id FROM emails").fetchall()
+    return {r["message_id"] for r in rows}
 
 
 def fetch_emails(order_by_priority=True, limit=200):
@@ -75,7 +139,6 @@ def fetch_emails(order_by_priority=True, limit=200):
     Returns list of dicts ordered (urgent first then newest) by default.
     """
     conn = _connect()
-    cur = conn.cursor()
 
     if order_by_priority:
         query = """
@@ -86,16 +149,40 @@ def fetch_emails(order_by_priority=True, limit=200):
                      datetime(received_at) DESC
             LIMIT ?
         """
-        cur.execute(query, (limit,))
     else:
-        cur.execute("""
+        query = """
             SELECT id, message_id, sender, subject, body, received_at,
                    priority, sentiment, requirements, contacts, draft_reply, status
             FROM emails
             ORDER BY datetime(received_at) DESC
             LIMIT ?
-        """, (limit,))
+        """
 
-    rows = [dict(r) for r in cur.fetchall()]
-    conn.close()
-    return rows
+    with _LOCK:
+        rows = conn.execute(query, (limit,)).fetchall()
+    return [dict(r) for r in rows]
+
+
+def fetch_stats():
+    """
+    Dashboard counters over all stored emails, aggregated by SQLite in a single query.
+    Rows with an unparseable received_at count as recent, as before.
+    """
+    conn = _connect()
+    query = """
+        SELECT COUNT(*) AS total,
+               COALESCE(SUM(priority = 'Urgent'), 0) AS urgent,
+               COALESCE(SUM(sentiment = 'Positive'), 0) AS positive,
+               COALESCE(SUM(sentiment = 'Negative'), 0) AS negative,
+               COALESCE(SUM(sentiment = 'Neutral'), 0) AS neutral,
+               COALESCE(SUM(COALESCE(datetime(received_at), datetime('now')) >= datetime('now', '-24 hours')), 0) AS last_24h,
+               COALESCE(SUM(status = 'resolved'), 0) AS resolved,
+               MAX(received_at) AS latest_received_at,
+               (SELECT value FROM meta WHERE key = 'data_version') AS data_version
+        FROM emails
+    """
+    with _LOCK:
+        row = conn.execute(query).fetchone()
+    stats = dict(row)
+    stats["pending"] = stats["total"] - stats["resolved"]
+    return stats
@@ -0,0 +1,155 @@
+# utils/kb_index.py
+import heapq
+import json
+import re
+import threading
+import time
+from pathlib import Path
+
+# Saved next to emails.db, never inside the KB folder people drop files into, and as JSON,
+# so loading it can't execute anything
+INDEX_FILE = Path(".kb_index.json")
+# In-place edits don't touch the folder's mtime, so the full per-file signature is still
+# re-checked, but at most this often; adds, removes and renames are picked up immediately
+SIGNATURE_RECHECK_SECONDS = 5.0
+
+_TOKEN_RE = re.compile(r"\w+")
+
+_lock = threading.Lock()
+_indexes = {}  # kb_dir -> index dict, kept in memory between calls
+_checked = {}  # kb_dir -> (dir mtime_ns, monotonic time of the last full signature check)
+
+
+def tokenize(text: str) -> frozenset:
+    return frozenset(_TOKEN_RE.findall((text or "").lower()))
+
+
+def kb_signature(kb_dir: Path) -> tuple:
+    """
+    (name, mtime_ns, size) for every .txt file; any add/remove/edit changes it.
+    """
+    if not kb_dir.exists():
+        return ()
+    sig = []
+    for path in sorted(kb_dir.glob("*.txt")):
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        sig.append((path.name, st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+def build_index(kb_dir: Path, signature: tuple = None) -> dict:
+    """
+    Read every KB file once and build {token: set(doc_ids)} postings.
+    Returns: dict with signature, doc_names, doc_texts, postings
+    """
+    if signature is None:
+        signature = kb_signature(kb_dir)
+    doc_names, doc_texts, postings = [], [], {}
+    for name, _, _ in signature:
+        try:
+            txt = (kb_dir / name).read_text(encoding="utf-8", errors="ignore")
+        except Exception:
+            continue
+        doc_id = len(doc_texts)
+        doc_names.append(name)
+        doc_texts.append(txt)
+        for tok in tokenize(txt):
+            postings.setdefault(tok, set()).add(doc_id)
+    return {"signature": signature, "doc_names": doc_names, "doc_texts": doc_texts, "postings": postings}
+
+
+def _read_saved(path: Path, kb_dir: Path, signature: tuple):
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("kb_dir") != str(kb_dir.resolve()):
+            return None
+        if tuple(tuple(entry) for entry in saved["signature"]) != signature:
+            return None
+        return {
+            "signature": signature,
+            "doc_names": saved["doc_names"],
+            "doc_texts": saved["doc_texts"],
+            "postings": {tok: set(ids) for tok, ids in saved["postings"].items()},
+        }
+    except Exception:
+        return None
+
+
+def _write_saved(path: Path, kb_dir: Path, index: dict):
+    try:
+        saved = {
+            "kb_dir": str(kb_dir.resolve()),
+            "signature": index["signature"],
+            "doc_names": index["doc_names"],
+            "doc_texts": index["doc_texts"],
+            "postings": {tok: sorted(ids) for tok, ids in index["postings"].items()},
+        }
+        tmp = path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(saved, f)
+        tmp.replace(path)
+    except Exception as e:
+        print("KB index save failed:", e)
+
+
+def load_index(kb_dir: Path) -> dict:
+    """
+    Return the index for kb_dir: from memory, else from the saved INDEX_FILE, else rebuilt.
+    Anything whose signature no longer matches the KB files is rebuilt and re-saved.
+    The in-memory index is trusted without re-stat'ing every file while the folder's
+    mtime is unchanged and the last full check is under SIGNATURE_RECHECK_SECONDS old.
+    """
+    index = _indexes.get(kb_dir)
+    try:
+        dir_mtime = kb_dir.stat().st_mtime_ns
+    except OSError:
+        dir_mtime = None
+    now = time.monotonic()
+    last = _checked.get(kb_dir)
+    if index is not None and last is not None and last[0] == dir_mtime \
+            and now - last[1] < SIGNATURE_RECHECK_SECONDS:
+        return index
+
+    signature = kb_signature(kb_dir)
+    _checked[kb_dir] = (dir_mtime, now)
+    if index is not None and index["signature"] == signature:
+        return index
+
+    with _lock:
+        index = _indexes.get(kb_dir)
+        if index is None or index["signature"] != signature:
+            index = _read_saved(INDEX_FILE, kb_dir, signature) if signature else None
+            if index is None:
+                index = build_index(kb_dir, signature)
+                if signature:
+                    _write_saved(INDEX_FILE, kb_dir, index)
+            _indexes[kb_dir] = index
+    return index
+
+
+def candidate_docs(index: dict, query_tokens) -> set:
+    """
+    Doc ids sharing at least one token with the query, read straight off the postings.
+    """
+    postings = index["postings"]
+    found = set()
+    for tok in query_tokens:
+        found.update(postings.get(tok, ()))
+    return found
+
+
+def search(index: dict, query_tokens, top_k: int = 3) -> list:
+    """
+    Rank docs by how many query tokens they contain, touching only the matching postings.
+    Returns: list of (score, doc_id), best first
+    """
+    counts = {}
+    postings = index["postings"]
+    for tok in query_tokens:
+        for doc_id in postings.get(tok, ()):
+            counts[doc_id] = counts.get(doc_id, 0) + 1
+    return [(score, doc_id) for doc_id, score in heapq.nlargest(top_k, counts.items(), key=lambda x: x[1])]
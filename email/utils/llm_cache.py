@@ -0,0 +1,160 @@
+# utils/llm_cache.py
+import hashlib
+import os
+import threading
+import time
+
+from utils.db import locked_connection
+
+# Cosine similarity above which a previously answered prompt is reused
+SIMILARITY_THRESHOLD = float(os.getenv("LLM_CACHE_SIM_THRESHOLD", "0.95"))
+EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
+# Least-recently-used entries beyond this are evicted
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+_embedder_lock = threading.Lock()
+_table_ready = False
+_embedder = None
+_embedder_loaded = False
+
+
+def _ensure_table(cur):
+    global _table_ready
+    if _table_ready:
+        return
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            hash TEXT PRIMARY KEY,
+            prompt TEXT,
+            scope TEXT,
+            embedding BLOB,
+            response TEXT,
+            last_used REAL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_scope ON llm_cache(scope)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)")
+    _table_ready = True
+
+
+def _get_embedder():
+    """
+    Lazily load the sentence-transformers model. Returns None if the optional
+    dependency is missing, in which case only exact-match caching is used.
+    """
+    global _embedder, _embedder_loaded
+    if not _embedder_loaded:
+        with _embedder_lock:
+            if not _embedder_loaded:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    _embedder = SentenceTransformer(EMBED_MODEL_NAME)
+                except Exception as e:
+                    print("Semantic cache disabled:", e)
+                    _embedder = None
+                _embedder_loaded = True
+    return _embedder
+
+
+def _embed(text: str):
+    embedder = _get_embedder()
+    if embedder is None:
+        return None
+    try:
+        import numpy as np
+        # the model silently truncates long inputs, and two texts sharing only their
+        # opening would then look identical - leave those to the exact-match tier
+        limit = getattr(embedder, "max_seq_length", None)
+        if limit and len(embedder.tokenizer.tokenize(text)) > limit - 2:
+            return None
+        vec = embedder.encode(text, normalize_embeddings=True)
+        return np.asarray(vec, dtype=np.float32)
+    except Exception as e:
+        print("Prompt embedding failed:", e)
+        return None
+
+
+def _lookup_exact(key: str):
+    with locked_connection() as conn:
+        cur = conn.cursor()
+        _ensure_table(cur)
+        row = cur.execute("SELECT response FROM llm_cache WHERE hash = ?", (key,)).fetchone()
+        if row:
+            cur.execute("UPDATE llm_cache SET last_used = ? WHERE hash = ?", (time.time(), key))
+    return row["response"] if row else None
+
+
+def _lookup_similar(vec, scope: str):
+    import numpy as np
+
+    with locked_connection() as conn:
+        rows = conn.execute(
+            "SELECT hash, embedding, response FROM llm_cache WHERE scope = ? AND embedding IS NOT NULL",
+            (scope,),
+        ).fetchall()
+    best_score, best_row = -1.0, None
+    for row in rows:
+        cached = np.frombuffer(row["embedding"], dtype=np.float32)
+        if cached.shape != vec.shape:
+            continue
+        # embeddings are stored normalized, so the dot product is the cosine
+        score = float(np.dot(vec, cached))
+        if score > best_score:
+            best_score, best_row = score, row
+    if best_row is None or best_score < SIMILARITY_THRESHOLD:
+        return None
+    with locked_connection() as conn:
+        conn.execute("UPDATE llm_cache SET last_used = ? WHERE hash = ?", (time.time(), best_row["hash"]))
+    return best_row["response"]
+
+
+def _store(key: str, prompt: str, scope, vec, response: str):
+    with locked_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (hash, prompt, scope, embedding, response, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, prompt, scope, vec.tobytes() if vec is not None else None, response, time.time()),
+        )
+        conn.execute("""
+            DELETE FROM llm_cache WHERE hash IN (
+                SELECT hash FROM llm_cache ORDER BY last_used ASC
+                LIMIT max(0, (SELECT COUNT(*) FROM llm_cache) - ?)
+            )
+        """, (MAX_ENTRIES,))
+
+
+def get_or_call(prompt: str, fn, semantic_text: str = None, scope: str = ""):
+    """
+    Return a cached LLM response for `prompt`, calling `fn(prompt)` on a miss.
+    Lookup order: exact SHA-256 match, then - only if `semantic_text` is given and
+    sentence-transformers is installed - the cached entry with the same `scope` whose
+    `semantic_text` embedding has cosine similarity >= SIMILARITY_THRESHOLD.
+    Callers pass the free text that varies between prompts (e.g. the customer email)
+    as `semantic_text`, and everything else the answer depends on as `scope`, so
+    structured prompts stay exact-match only. Failed calls (None / empty responses)
+    are not cached; the table keeps at most MAX_ENTRIES, evicting least recently used.
+    """
+    key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    scope_key = hashlib.sha256(scope.encode("utf-8")).hexdigest() if semantic_text else None
+    vec = None
+    try:
+        cached = _lookup_exact(key)
+        if cached is not None:
+            return cached
+        if semantic_text:
+            vec = _embed(semantic_text)
+            if vec is not None:
+                cached = _lookup_similar(vec, scope_key)
+                if cached is not None:
+                    return cached
+    except Exception as e:
+        print("LLM cache lookup failed:", e)
+        vec = None
+
+    response = fn(prompt)
+    if response:
+        try:
+            _store(key, prompt, scope_key, vec, response)
+        except Exception as e:
+            print("LLM cache store failed:", e)
+    return response